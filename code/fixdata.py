@@ -6,19 +6,80 @@ import re
 import json
 import sys
 import os.path
+import math
 from pytz import timezone
 import datetime
 
 data_path = "../data/"
 
-def filter_data(df):
-    """filters duplicated or inconsistent data inplace"""
+created_at_format = "%a %b %d %H:%M:%S %z %Y" # created_at in original dataset, e.g. Wed Nov 12 09:09:13 +0000 2014
+fixed_created_at_format = "%Y-%m-%d %H:%M:%S%z" # created_at in fixed dataset, e.g. 2014-11-12 09:09:13+00:00
+
+def parse_created_at(df, date_format=fixed_created_at_format):
+    """parses the created_at field inplace into UTC dates with the given format, unless already parsed"""
+    if pd.api.types.is_datetime64_any_dtype(df['created_at']):
+        if df['created_at'].dt.tz is None:
+            df['created_at'] = df['created_at'].dt.tz_localize('UTC')
+        else:
+            df['created_at'] = df['created_at'].dt.tz_convert('UTC')
+    else:
+        df['created_at'] = pd.to_datetime(df['created_at'], format=date_format, utc=True)
+
+def sort_by_created_at(df, date_format=fixed_created_at_format):
+    """sorts df by the created_at field inplace, parsing it with the given format if not already
+    parsed, and caches it as seconds since epoch in a new column 'created_at_epoch' used by
+    time_window and count_per_interval"""
+    parse_created_at(df, date_format)
+    if not df['created_at'].is_monotonic_increasing:
+        df.sort_values('created_at', kind='mergesort', inplace=True) # stable, keeps order within a second
+    df['created_at_epoch'] = df['created_at'].values.astype('datetime64[s]').astype(np.int64)
+
+def to_epoch(date):
+    """takes a date (string, datetime or Timestamp, UTC if no timezone given) as parameter and returns
+    the first whole second since epoch not before it"""
+    ts = pd.Timestamp(date)
+    ts = ts.tz_localize('UTC') if ts.tzinfo is None else ts.tz_convert('UTC')
+    return math.ceil(ts.timestamp())
+
+def window_bounds(df, start=None, end=None):
+    """takes a dataframe df sorted with sort_by_created_at as parameter, returns the positions [lo, hi)
+    of the rows created in [start, end), where a bound of None leaves that side of the range open"""
+    epoch = df['created_at_epoch'].values
+    lo = 0 if start is None else int(np.searchsorted(epoch, to_epoch(start), side='left'))
+    hi = len(epoch) if end is None else int(np.searchsorted(epoch, to_epoch(end), side='left'))
+    return lo, max(lo, hi)
+
+def time_window(df, start=None, end=None):
+    """takes a dataframe df sorted with sort_by_created_at as parameter, returns a slice of df with
+    the rows created in [start, end) found by binary search, without copying the data"""
+    lo, hi = window_bounds(df, start, end)
+    return df.iloc[lo:hi]
+
+def count_per_interval(df, start, end, interval):
+    """takes a dataframe df sorted with sort_by_created_at as parameter, returns a series with the
+    number of rows created in each consecutive interval (a Timedelta) from start up to end, indexed
+    by the start of the interval"""
+    first = to_epoch(start)
+    last = to_epoch(end)
+    step = int(interval.total_seconds())
+    intervals = max(0, math.ceil((last - first) / step))
+
+    edges = first + step * np.arange(intervals + 1, dtype=np.int64)
+    edges[-1] = min(edges[-1], last) # the last interval stops at end
+    positions = np.searchsorted(df['created_at_epoch'].values, edges, side='left')
+
+    return pd.Series(np.diff(positions), index=pd.to_datetime(edges[:-1], unit='s', utc=True))
+
+def filter_data(df, date_format=created_at_format):
+    """filters duplicated or inconsistent data inplace, leaving it sorted by creation date; the
+    created_at field is parsed with date_format unless already parsed, the default being the
+    format of the original dataset"""
 
     df.drop_duplicates(inplace=True) # remove duplicated data
 
     # remove if any of the following fields is NaN:
-    # id_str(tweet id), from_user_id_str(user id), text, entities_str(hashtags)
-    df.dropna(subset=['id_str', 'from_user_id_str', 'text', 'entities_str'], inplace=True)
+    # id_str(tweet id), from_user_id_str(user id), text, entities_str(hashtags), created_at
+    df.dropna(subset=['id_str', 'from_user_id_str', 'text', 'entities_str', 'created_at'], inplace=True)
 
     # remove tweets without "cometlanding" in the text and the hashtag used
     df.drop(df[~(df['entities_str'].str.contains("cometlanding", case=False))].index, inplace=True)
@@ -32,8 +93,11 @@ def filter_data(df):
     start_date = timezone('GMT-0').localize(start_date)
     end_date = datetime.datetime(2014,12,6)
     end_date = timezone('GMT-0').localize(end_date)
-    df.drop(df[(pd.to_datetime(df['created_at'], utc=True) < start_date) 
-                | (pd.to_datetime(df['created_at'], utc=True) >= end_date)].index, inplace=True)
+
+    # once sorted, the tweets in range are a single slice, so only the rows before and after it are dropped
+    sort_by_created_at(df, date_format)
+    lo, hi = window_bounds(df, start_date, end_date)
+    df.drop(df.index[:lo].append(df.index[hi:]), inplace=True)
 
 
 def refine_id(df):
@@ -94,6 +158,23 @@ def create_retweet_columns(df):
         lambda x: json.loads(x["entities_str"])["user_mentions"][0]["name"] 
         if isRetweet(x) else np.NaN, axis = 1)
 
+def create_mention_columns(df):
+    """creates a new column 'mention_user_ids_str' with the ids of the users mentioned in each tweet
+    separated by spaces. Users already linked to the tweet by another column are left out, so that
+    no interaction is counted twice: the retweeted user of a retweet (see create_retweet_columns)
+    and the replied user of a reply (in_reply_to_user_id_str), each left out once."""
+
+    def mentions_of(row):
+        mentions = [m['id_str'] for m in json.loads(row['entities_str'])['user_mentions']]
+        if re.search("^RT @.", row['text']) and mentions:
+            mentions = mentions[1:]
+        replied = row['in_reply_to_user_id_str']
+        if pd.notnull(replied) and replied in mentions:
+            mentions.remove(replied) # removes the first occurrence only
+        return " ".join(mentions)
+
+    df['mention_user_ids_str'] = df.apply(mentions_of, axis=1)
+
 def refine_application(df):
     """refines the application field by making the identified application device non-specific"""
     
@@ -110,6 +191,46 @@ def refine_application(df):
     df['applications'] = df.apply(application_only, axis=1)
 
 
+def create_user_rollup(df):
+    """takes a dataframe df sorted with sort_by_created_at as parameter, returns a dataframe with one
+    row per user sending or receiving tweets, indexed by integer user id, with the number of tweets
+    sent, of retweets, replies and mentions (see create_mention_columns) received, of applications
+    used, and the latest follower and friend counts"""
+
+    # one row per event involving a user, received ones first so that the screen name kept by
+    # 'last' below is the one of the latest tweet sent by the user if there is any
+    retweeted = pd.DataFrame({'user_id': df['retweet_user_id_str'],
+                              'screen_name': df['retweet_user_screen_name'], 'retweets_received': 1})
+    replied = pd.DataFrame({'user_id': df['in_reply_to_user_id_str'],
+                            'screen_name': df['in_reply_to_screen_name'], 'replies_received': 1})
+    mentioned = df['mention_user_ids_str'].str.split().explode()
+    mentioned = pd.DataFrame({'user_id': mentioned, 'mentions_received': 1})
+    sent = pd.DataFrame({'user_id': df['from_user_id_str'], 'screen_name': df['from_user'], 'tweets': 1,
+                         'application': df['applications'],
+                         'user_followers_count': df['user_followers_count'],
+                         'user_friends_count': df['user_friends_count'],
+                         'last_tweet_at': df['created_at']})
+
+    events = pd.concat([retweeted, replied, mentioned, sent], ignore_index=True)
+    events = events[pd.notna(events['user_id'])]
+    events['user_id'] = events['user_id'].astype(np.int64)
+
+    # single grouped aggregation, rows being in order of creation within each kind of event
+    rollup = events.groupby('user_id').agg(
+        screen_name=('screen_name', 'last'),
+        tweets=('tweets', 'sum'),
+        retweets_received=('retweets_received', 'sum'),
+        replies_received=('replies_received', 'sum'),
+        mentions_received=('mentions_received', 'sum'),
+        applications_used=('application', 'nunique'),
+        user_followers_count=('user_followers_count', 'last'),
+        user_friends_count=('user_friends_count', 'last'),
+        last_tweet_at=('last_tweet_at', 'max'))
+
+    counts = ['tweets', 'retweets_received', 'replies_received', 'mentions_received']
+    rollup[counts] = rollup[counts].astype(np.int64)
+    return rollup
+
 def createJson(df, file):
     """takes a dataframe df and filename file as parameter, generate a JSON file with given file for 
     entities_str field of df"""
@@ -130,6 +251,17 @@ def createJson(df, file):
         writer.write(json_result)
         writer.close()
 
+def read_fixed_data(file):
+    """reads the CSV file written by main, returning a dataframe sorted with sort_by_created_at"""
+    df = pd.read_csv(file,
+                 dtype={"id_str": str, "in_reply_to_user_id_str": str, "from_user_id_str": str,
+                        "in_reply_to_status_id_str": str, "user_followers_count": "Int64",
+                        "user_friends_count": "Int64", "geo_coordinates": str,
+                        "retweet_user_id_str": str, "mention_user_ids_str": str}
+                 )
+    sort_by_created_at(df)
+    return df
+
 def usage():
     print("Usage: ./fixdata.py <csv filename>")
 
@@ -137,8 +269,7 @@ def main(read):
     df = pd.read_csv(read,
                  dtype={"id_str": str, "in_reply_to_user_id_str": str, "from_user_id_str": str,
                         "in_reply_to_status_id_str": str, "user_followers_count": "Int64",
-                        "user_friends_count": "Int64", "geo_coordinates": str}, 
-                        parse_dates=['created_at']
+                        "user_friends_count": "Int64", "geo_coordinates": str}
                  )
     df.drop(columns=['time'], inplace=True) # remove time field as duplicated with created_at field
     
@@ -147,12 +278,14 @@ def main(read):
     create_application_columns(df)
     refine_application(df)
     create_retweet_columns(df)
+    create_mention_columns(df)
 
     fixfile = read[:-4] + "Fixed" # filename prefix of fixed data in csv and json
 
     createJson(df, fixfile)
 
     df.to_csv(fixfile + ".csv", index=False)
+    create_user_rollup(df).to_csv(fixfile + "Users.csv")
 
 if __name__ == "__main__":
     if (len(sys.argv) != 2):
@@ -4,14 +4,16 @@ import pandas as pd
 import sys
 import os.path
 import json
-import re
 import numpy as np
 import matplotlib.pyplot as plt
 from wordcloud import WordCloud
 from PIL import Image
 import networkx as nx
+from scipy import sparse
 import seaborn as sns
 
+import fixdata as fd
+
 data_path = "../data/"
 image_path = "../images/"
 
@@ -54,8 +56,8 @@ def createTweetsTypeChart(df):
     plt.rcParams["figure.figsize"] = (5,5)
 
 def createDailyTimelinePlot(df):
-    # create new dataframe with creation date as index and grouped with the date
-    days = df.set_index('created_at').groupby(pd.Grouper(freq='D'))
+    """Given a dataframe df sorted with fixdata.sort_by_created_at, generate chart showing the
+    number of tweets for each day from the first to the last recorded date"""
 
     # guidance for plotting line chart:
     # https://datatofish.com/line-chart-python-matplotlib/
@@ -66,15 +68,15 @@ def createDailyTimelinePlot(df):
     # https://www.tutorialspoint.com/python/time_strftime.htm
     # last accessed: 07/Apr/2022
 
-    # method to group by date learnt from:
-    # https://pandas.pydata.org/pandas-docs/stable/user_guide/timeseries.html#offset-aliases
-    # last accessed: 07/Apr/2022
+    # number of tweets per day, counted by binary search on the sorted creation dates
+    day = pd.Timedelta(days=1)
+    days = fd.count_per_interval(df, df['created_at'].iloc[0].floor(day),
+                                 df['created_at'].iloc[-1].floor(day) + day, day)
 
     # list of days with records of tweets
-    day_labels = [str(ts.strftime("%d/%m"))
-               for ts in days.count()["id_str"].index.tolist()]
+    day_labels = [str(ts.strftime("%d/%m")) for ts in days.index.tolist()]
     # list of number of tweets for each recorded date
-    day_data = days.count()["id_str"].tolist()
+    day_data = days.tolist()
 
     plt.rcParams["figure.figsize"] = (20, 30)
 
@@ -85,25 +87,28 @@ def createDailyTimelinePlot(df):
     plt.plot(day_labels, day_data)
 
 def createActiveDayTimelinePlot(df):
-    """Given a dataframe df, generate chart showing the timeline of the tweets
-    for the day with the most records per hour"""
+    """Given a dataframe df sorted with fixdata.sort_by_created_at, generate chart showing
+    the timeline of the tweets for the day with the most records per hour"""
 
     # method to convert date to string in specific format learnt from:
     # https://www.programiz.com/python-programming/datetime/strftime
     # https://www.tutorialspoint.com/python/time_strftime.htm
     # last accessed: 07/Apr/2022
 
-    # method to group by date learnt from:
-    # https://pandas.pydata.org/pandas-docs/stable/user_guide/timeseries.html#offset-aliases
-    # last accessed: 07/Apr/2022
+    date_raw = fd.time_window(df, "2014-11-12", "2014-11-13") # get dataframe with tweets on 2014-11-12
 
-    date_raw = df[df['created_at'].apply(
-    lambda x: True if re.search('^2014-11-12', str(x)) else False)] # get dataframe with tweets on 2014-11-12
-    date = date_raw.set_index('created_at').groupby(pd.Grouper(freq='H'))
+    # number of tweets per hour, from the hour of the first to the hour of the last tweet of the day,
+    # leaving the chart empty if there is no tweet that day
+    hour = pd.Timedelta(hours=1)
+    if date_raw.empty:
+        date = pd.Series([], dtype=np.int64)
+    else:
+        date = fd.count_per_interval(date_raw, date_raw['created_at'].iloc[0].floor(hour),
+                                     date_raw['created_at'].iloc[-1].floor(hour) + hour, hour)
 
     date_labels = [str(ts.strftime("%H"))
-               for ts in date.count()["id_str"].index.tolist()] # list of hours with records of tweets
-    date_data = date.count()["id_str"].tolist() # list of number of tweets for each recorded hour
+               for ts in date.index.tolist()] # list of hours with records of tweets
+    date_data = date.tolist() # list of number of tweets for each recorded hour
 
     plt.rcParams["figure.figsize"] = (5,5)
     
@@ -111,7 +116,8 @@ def createActiveDayTimelinePlot(df):
     plt.xlabel("Hour")
     plt.ylabel("Tweets")
 
-    plt.stem(date_labels, date_data)
+    if date_data: # matplotlib cannot draw a stem plot without any point
+        plt.stem(date_labels, date_data)
 
 def createApplicationChart(df):
     """Given a dataframe df, generate chart showing the number of tweets for
@@ -348,6 +354,56 @@ def createMentionNetwork(df):
 
     return mentions_network
 
+def getHashtagsOfTweet(entities):
+    """Given the entities_str JSON of a tweet, return the hashtags it used, leaving out
+    cometlanding as in getListOfAllHashTags since every tweet carries it"""
+    return [h['text'] for h in json.loads(entities)['hashtags'] if h['text'].lower() != "cometlanding"]
+
+def createHashtagIncidenceMatrix(df):
+    """Given a dataframe df, return a sparse tweet x hashtag matrix holding 1 where the tweet in
+    that row of df used the hashtag, along with the hashtags corresponding to its columns"""
+
+    tags = df['entities_str'].map(getHashtagsOfTweet)
+
+    rows = np.repeat(np.arange(len(tags)), tags.str.len().values) # row of the tweet of each occurrence
+    columns, hashtags = pd.factorize(pd.Series([h for t in tags for h in t], dtype=object))
+
+    incidence = sparse.csr_matrix((np.ones(len(columns), dtype=np.int64), (rows, columns)),
+                                  shape=(len(tags), len(hashtags)))
+    incidence.data[:] = 1 # a hashtag repeated within a tweet counts once
+    return incidence, np.asarray(hashtags, dtype=object)
+
+def getHashtagCooccurrence(incidence, hashtags, top_k=100, by='weight', min_count=1):
+    """Given a tweet x hashtag incidence matrix and its hashtags, return a dataframe of the top_k
+    pairs of hashtags used together (all pairs if top_k is None) ranked by the column by, with the
+    number of tweets using both as weight, and their pointwise mutual information and lift. Pairs
+    used together in fewer than min_count tweets are left out."""
+
+    tweets = incidence.shape[0]
+    counts = np.asarray(incidence.sum(axis=0)).ravel() # number of tweets using each hashtag
+
+    # entry (i, j) of the product is the number of tweets using both hashtag i and hashtag j,
+    # the upper triangle holding each pair once without the diagonal
+    cooccurrence = sparse.triu(incidence.T @ incidence, k=1).tocoo()
+    keep = cooccurrence.data >= min_count
+    source, target, weight = cooccurrence.row[keep], cooccurrence.col[keep], cooccurrence.data[keep]
+
+    # lift compares how often a pair is used together against how often it would be if the two
+    # hashtags were used independently of each other
+    lift = weight * tweets / (counts[source] * counts[target])
+    pairs = pd.DataFrame({'source': hashtags[source], 'target': hashtags[target], 'weight': weight,
+                          'pmi': np.log2(lift), 'lift': lift})
+
+    pairs = pairs.sort_values([by, 'weight'], ascending=False, kind='mergesort')
+    if top_k is not None:
+        pairs = pairs.head(top_k)
+    return pairs.reset_index(drop=True)
+
+def createHashtagNetwork(pairs):
+    """creates a network for hashtags from the pairs given by getHashtagCooccurrence, linking
+    hashtags used in the same tweets with the weight, pmi and lift of the pair"""
+    return nx.from_pandas_edgelist(pairs, 'source', 'target', edge_attr=['weight', 'pmi', 'lift'])
+
 # Method for visualisation of network:
 # https://stackoverflow.com/questions/17381006/large-graph-visualization-with-python-and-networkx
 # posted by: Vikram
@@ -377,9 +433,10 @@ def main(read):
     df = pd.read_csv(read + ".csv",
                  dtype={"id_str": str, "in_reply_to_user_id_str": str, "from_user_id_str": str,
                         "in_reply_to_status_id_str": str, "user_followers_count": "Int64",
-                        "user_friends_count": "Int64", "geo_coordinates": str}, 
-                        parse_dates=['created_at']
+                        "user_friends_count": "Int64", "geo_coordinates": str}
                  )
+    fd.sort_by_created_at(df) # parse creation dates once and sort, for the timeline charts
+
     createTweetsTypeChart(df)
     plt.savefig(image_path + "tweet_type.png", dpi=300, bbox_inches='tight')
     plt.clf()
@@ -423,6 +480,13 @@ def main(read):
     plt.close()
     del fig
 
+    hashtag_pairs = getHashtagCooccurrence(*createHashtagIncidenceMatrix(df))
+    hashtag_pairs.to_csv(read + "HashtagPairs.csv", index=False)
+    fig = plotNetworkGraph(createHashtagNetwork(hashtag_pairs))
+    plt.savefig(image_path + "hashtag_network.pdf", bbox_inches='tight')
+    plt.close()
+    del fig
+
 def usage():
     print("Usage: ./generateGraphs <file prefix>")
 
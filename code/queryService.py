@@ -0,0 +1,386 @@
+#!/usr/bin/env python
+
+import pandas as pd
+import numpy as np
+import sys
+import os.path
+import json
+import io
+import asyncio
+import concurrent.futures
+from collections import OrderedDict
+from urllib.parse import urlsplit, parse_qs, unquote
+import matplotlib
+matplotlib.use("Agg") # render charts without a display, the service has no window to draw in
+import matplotlib.pyplot as plt
+
+import generateGraphs as gg
+import fixdata as fd
+import threads as th
+
+data_path = "../data/"
+default_host = "127.0.0.1"
+default_port = 8080
+chart_cache_size = 32 # maximum number of rendered chart images kept in memory
+chart_dpi = 100
+max_timeline_intervals = 100000 # largest number of intervals answered by /timeline
+
+# granularities accepted by /timeline, mapped to the length of one interval
+granularities = {"minute": pd.Timedelta(minutes=1), "hour": pd.Timedelta(hours=1),
+                 "day": pd.Timedelta(days=1), "week": pd.Timedelta(weeks=1)}
+
+# charts that can be requested from /charts/<name>.png, mapped to the function in generateGraphs
+# drawing them; the dataframe passed in is already restricted to the requested time window
+charts = {
+    "tweet_type": gg.createTweetsTypeChart,
+    "timeline_daily": gg.createDailyTimelinePlot,
+    "timeline_2014_11_12": gg.createActiveDayTimelinePlot,
+    "top_applications": gg.createApplicationChart,
+}
+
+class QueryError(Exception):
+    """raised when a request cannot be answered, carrying the HTTP status to respond with"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+class LRUCache:
+    """fixed size mapping discarding the least recently used entry when full"""
+
+    def __init__(self, size):
+        self.size = size
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        """returns the value stored for key and marks it as recently used, or None if not stored"""
+        if key not in self.entries:
+            return None
+        self.entries.move_to_end(key)
+        return self.entries[key]
+
+    def put(self, key, value):
+        """stores value for key, discarding the least recently used entry if the cache is full"""
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+def createHashtagIndex(df, incidence, hashtags):
+    """Given a dataframe df sorted with fixdata.sort_by_created_at and its hashtag incidence matrix
+    and hashtags from generateGraphs.createHashtagIncidenceMatrix, return a dataframe with one row
+    per tweet using a hashtag holding the creation date of the tweet, in the same order"""
+
+    # indptr holds where the hashtag columns of each row start, so the tweets are read from it
+    # rather than parsing the JSON of every tweet again
+    rows = np.repeat(np.arange(incidence.shape[0]), np.diff(incidence.indptr))
+    return pd.DataFrame({'created_at': df['created_at'].iloc[rows].reset_index(drop=True),
+                         'created_at_epoch': df['created_at_epoch'].values[rows],
+                         'hashtag': hashtags[incidence.indices]})
+
+def createNeighbourIndex(df):
+    """Given a dataframe df with the mention column of fixdata.create_mention_columns, return a
+    dictionary mapping each screen name to the users it replied to, retweeted and mentioned and
+    the users that did so to it, with the number of times each. As in fixdata.create_user_rollup,
+    the retweeted user of a retweet and the replied user of a reply are not counted as mentioned"""
+
+    replies = df[pd.notna(df['in_reply_to_screen_name'])]
+    retweets = df[pd.notna(df['retweet_user_screen_name'])]
+    mentions = pd.DataFrame({'row': np.arange(len(df)), 'from_user': df['from_user'].values,
+                             'id': df['mention_user_ids_str'].str.split().values})
+    mentions = mentions.explode('id').dropna(subset=['id'])
+
+    # screen names of the mentioned ids, taken from the columns of the data where possible and
+    # otherwise from the entities of the few tweets mentioning users seen nowhere else
+    names = pd.concat([
+        pd.Series(df['from_user'].values, index=df['from_user_id_str'].values),
+        pd.Series(replies['in_reply_to_screen_name'].values, index=replies['in_reply_to_user_id_str'].values),
+        pd.Series(retweets['retweet_user_screen_name'].values, index=retweets['retweet_user_id_str'].values)])
+    unknown = mentions['row'][~mentions['id'].isin(names.index)].unique()
+    names = pd.concat([names, pd.Series(
+        {m['id_str']: m['screen_name'] for x in df['entities_str'].values[unknown]
+         for m in json.loads(x)['user_mentions']}, dtype=object)])
+    mentions['mentioned'] = mentions['id'].map(names[~names.index.duplicated(keep='last')])
+
+    # one row per directed edge, labelled from the point of view of the sender
+    edges = pd.concat([
+        pd.DataFrame({'source': replies['from_user'], 'target': replies['in_reply_to_screen_name'],
+                      'relation': "replied_to"}),
+        pd.DataFrame({'source': retweets['from_user'], 'target': retweets['retweet_user_screen_name'],
+                      'relation': "retweeted"}),
+        pd.DataFrame({'source': mentions['from_user'], 'target': mentions['mentioned'],
+                      'relation': "mentioned"}),
+    ], ignore_index=True).dropna()
+
+    # the same edges seen from the receiving user
+    reverse = edges.rename(columns={'source': 'target', 'target': 'source'})
+    reverse['relation'] = reverse['relation'].map(
+        {"replied_to": "replied_by", "retweeted": "retweeted_by", "mentioned": "mentioned_by"})
+
+    counts = pd.concat([edges, reverse], ignore_index=True).groupby(
+        ['source', 'relation', 'target']).size()
+
+    neighbours = {}
+    for (source, relation, target), count in counts.items():
+        neighbours.setdefault(source, {}).setdefault(relation, {})[target] = int(count)
+    return neighbours
+
+class QueryIndex:
+    """holds the cleaned dataset and the indexes derived from it, answering queries from memory"""
+
+    def __init__(self, df, json_file):
+        """takes a dataframe df of the fixed data sorted with fixdata.sort_by_created_at and the path
+        of the JSON file of its entities as parameters"""
+        self.json_file = json_file
+        self.df = df
+        self.hashtag_incidence, self.hashtag_names = gg.createHashtagIncidenceMatrix(self.df)
+        self.hashtags = createHashtagIndex(self.df, self.hashtag_incidence, self.hashtag_names)
+        if 'mention_user_ids_str' not in self.df.columns: # data fixed before mentions were kept
+            fd.create_mention_columns(self.df)
+        self.neighbours = createNeighbourIndex(self.df)
+        self.threads = th.buildThreadIndex(self.df)
+        self.users = fd.create_user_rollup(self.df)
+        self.thread_metrics = th.getThreadMetrics(self.df, self.threads)
+        self.applications = self.df['applications'].value_counts()
+        self.chart_cache = LRUCache(chart_cache_size)
+
+    def hashtagCounts(self, start=None, end=None, top=25):
+        """returns the top most used hashtags with the number of tweets using them in [start, end)"""
+        counts = fd.time_window(self.hashtags, start, end)['hashtag'].value_counts().head(top)
+        return [{'hashtag': h, 'count': int(c)} for h, c in counts.items()]
+
+    def hashtagPairs(self, start=None, end=None, top=25, by='weight', min_count=1):
+        """returns the top pairs of hashtags used together in [start, end) ranked by weight, pmi or lift"""
+        if by not in ('weight', 'pmi', 'lift'):
+            raise QueryError(400, "Unknown ranking: " + by)
+        # rows of the incidence matrix follow the sorted tweets, so the window is a slice of rows
+        lo, hi = fd.window_bounds(self.df, start, end)
+        pairs = gg.getHashtagCooccurrence(self.hashtag_incidence[lo:hi], self.hashtag_names,
+                                          top, by, min_count)
+        return pairs.to_dict('records')
+
+    def timeline(self, start=None, end=None, granularity="hour"):
+        """returns the number of tweets per interval of the given granularity in [start, end)"""
+        if granularity not in granularities:
+            raise QueryError(400, "Unknown granularity: " + granularity)
+        tweets = fd.time_window(self.df, start, end)
+        if tweets.empty:
+            return []
+        # intervals are aligned on the given start, or else on the first tweet rounded down to the
+        # granularity, and only cover the tweets found so that a wide window stays cheap
+        interval = granularities[granularity]
+        first_tweet = tweets['created_at'].iloc[0]
+        if start is None:
+            first = first_tweet.floor(interval)
+        else:
+            first = start + ((first_tweet - start) // interval) * interval
+        last = tweets['created_at'].iloc[-1] + pd.Timedelta(seconds=1)
+        if end is not None:
+            last = min(last, end)
+        if (last - first) / interval > max_timeline_intervals:
+            raise QueryError(400, "Too many intervals, use a coarser granularity or a shorter window")
+        counts = fd.count_per_interval(tweets, first, last, interval)
+        return [{'start': ts.isoformat(), 'count': int(c)} for ts, c in counts.items()]
+
+    def largestThreads(self, top=25):
+        """returns the top largest conversation threads with their size, depth and time to first reply"""
+        metrics = self.thread_metrics.head(top).copy()
+        metrics['created_at'] = metrics['created_at'].map(lambda ts: pd.Timestamp(ts).isoformat())
+        return metrics.to_dict('records')
+
+    def mostReplied(self, top=25):
+        """returns the top tweets with the most direct replies"""
+        return th.getMostRepliedTweets(self.df, self.threads, top).to_dict('records')
+
+    def userNeighbours(self, user):
+        """returns the users the given screen name interacted with, grouped by type of interaction"""
+        if user not in self.neighbours:
+            raise QueryError(404, "Unknown user: " + user)
+        return self.neighbours[user]
+
+    def userProfile(self, user_id):
+        """returns the activity rollup of the user with the given integer id"""
+        if user_id not in self.users.index:
+            raise QueryError(404, "Unknown user id: " + str(user_id))
+        profile = self.users.loc[[user_id]].reset_index()
+        return json.loads(profile.to_json(orient='records', date_format='iso'))[0]
+
+    def applicationCounts(self, start=None, end=None):
+        """returns the number of tweets sent from each application in [start, end)"""
+        if start is None and end is None:
+            counts = self.applications
+        else:
+            counts = fd.time_window(self.df, start, end)['applications'].value_counts()
+        return [{'application': a, 'count': int(c)} for a, c in counts.items()]
+
+    def chart(self, name, start=None, end=None):
+        """returns the PNG image of the named chart for [start, end), rendering it if not cached;
+        popular_hashtags is drawn from the whole JSON file, so always covers the full dataset"""
+        if name == "popular_hashtags":
+            start, end = None, None # one cached image whatever window is asked for
+        key = (name, start, end)
+        image = self.chart_cache.get(key)
+        if image is None:
+            image = self.renderChart(name, start, end)
+            self.chart_cache.put(key, image)
+        return image
+
+    def renderChart(self, name, start, end):
+        """draws the named chart for [start, end) and returns it as PNG bytes"""
+        plt.close('all')
+        if name == "popular_hashtags":
+            gg.createHashtagChart(self.json_file)
+        elif name in charts:
+            tweets = fd.time_window(self.df, start, end)
+            if tweets.empty:
+                raise QueryError(404, "No tweets in the requested window")
+            charts[name](tweets)
+        else:
+            raise QueryError(404, "Unknown chart: " + name)
+
+        buffer = io.BytesIO()
+        plt.savefig(buffer, format="png", dpi=chart_dpi, bbox_inches='tight')
+        plt.close('all')
+        plt.rcdefaults() # the chart functions change the global figure size
+        return buffer.getvalue()
+
+def parseTime(params, name):
+    """returns the UTC timestamp given for query parameter name, or None if it was not given"""
+    if name not in params:
+        return None
+    try:
+        ts = pd.Timestamp(params[name][0])
+    except ValueError:
+        raise QueryError(400, "Invalid date for " + name + ": " + params[name][0])
+    return ts.tz_localize('UTC') if ts.tzinfo is None else ts.tz_convert('UTC')
+
+def parseInt(params, name, default):
+    """returns the positive integer given for query parameter name, or default if it was not given"""
+    if name not in params:
+        return default
+    try:
+        value = int(params[name][0])
+    except ValueError:
+        value = 0
+    if value <= 0:
+        raise QueryError(400, "Invalid value for " + name + ": " + params[name][0])
+    return value
+
+class QueryService:
+    """asyncio HTTP service answering GET requests from a QueryIndex"""
+
+    def __init__(self, index):
+        self.index = index
+        # matplotlib is not thread safe, so all charts are drawn on one worker thread
+        self.renderer = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        # other queries only read the indexes, they are answered on a pool of worker threads
+        self.queries = concurrent.futures.ThreadPoolExecutor()
+
+    async def run(self, executor, function, *args):
+        """calls function with args on executor, so that the event loop keeps serving other clients"""
+        return await asyncio.get_running_loop().run_in_executor(executor, function, *args)
+
+    async def route(self, path, params):
+        """returns the content type and body answering a request for path with query params"""
+        if path == "/":
+            body = {'endpoints': ["/hashtags?start=&end=&top=",
+                                  "/hashtag_pairs?start=&end=&top=&by=&min_count=",
+                                  "/timeline?start=&end=&granularity=", "/threads?top=",
+                                  "/most_replied?top=", "/neighbours?user=", "/users?id=",
+                                  "/applications?start=&end=",
+                                  "/charts/<name>.png?start=&end="],
+                    'granularities': list(granularities),
+                    'charts': list(charts) + ["popular_hashtags"]}
+        elif path == "/hashtags":
+            body = await self.run(self.queries, self.index.hashtagCounts, parseTime(params, 'start'), parseTime(params, 'end'),
+                                            parseInt(params, 'top', 25))
+        elif path == "/hashtag_pairs":
+            body = await self.run(self.queries, self.index.hashtagPairs, parseTime(params, 'start'),
+                                  parseTime(params, 'end'), parseInt(params, 'top', 25),
+                                  params.get('by', ["weight"])[0], parseInt(params, 'min_count', 1))
+        elif path == "/timeline":
+            body = await self.run(self.queries, self.index.timeline, parseTime(params, 'start'),
+                                  parseTime(params, 'end'), params.get('granularity', ["hour"])[0])
+        elif path == "/threads":
+            body = await self.run(self.queries, self.index.largestThreads, parseInt(params, 'top', 25))
+        elif path == "/most_replied":
+            body = await self.run(self.queries, self.index.mostReplied, parseInt(params, 'top', 25))
+        elif path == "/neighbours":
+            if 'user' not in params:
+                raise QueryError(400, "Missing parameter: user")
+            body = await self.run(self.queries, self.index.userNeighbours, params['user'][0])
+        elif path == "/users":
+            if 'id' not in params:
+                raise QueryError(400, "Missing parameter: id")
+            body = await self.run(self.queries, self.index.userProfile, parseInt(params, 'id', None))
+        elif path == "/applications":
+            body = await self.run(self.queries, self.index.applicationCounts, parseTime(params, 'start'),
+                                  parseTime(params, 'end'))
+        elif path.startswith("/charts/") and path.endswith(".png"):
+            name = path[len("/charts/"):-len(".png")]
+            image = await self.run(self.renderer, self.index.chart, name,
+                                   parseTime(params, 'start'), parseTime(params, 'end'))
+            return "image/png", image
+        else:
+            raise QueryError(404, "Unknown path: " + path)
+        return "application/json", json.dumps(body).encode('utf-8')
+
+    async def handle(self, reader, writer):
+        """reads a single HTTP request from reader and writes the response to writer"""
+        try:
+            request_line = (await reader.readline()).decode('latin-1').split()
+            # skip the headers, no request needs them
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+
+            if len(request_line) != 3:
+                raise QueryError(400, "Malformed request")
+            if request_line[0] != "GET":
+                raise QueryError(405, "Only GET is supported")
+            url = urlsplit(request_line[1])
+            status = 200
+            content_type, body = await self.route(unquote(url.path), parse_qs(url.query))
+        except QueryError as e:
+            status = e.status
+            content_type, body = "application/json", json.dumps({'error': str(e)}).encode('utf-8')
+        except Exception as e:
+            status = 500
+            content_type, body = "application/json", json.dumps({'error': repr(e)}).encode('utf-8')
+
+        reasons = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+                   500: "Internal Server Error"}
+        header = ("HTTP/1.1 " + str(status) + " " + reasons[status] + "\r\n"
+                  + "Content-Type: " + content_type + "\r\n"
+                  + "Content-Length: " + str(len(body)) + "\r\n"
+                  + "Connection: close\r\n\r\n")
+        writer.write(header.encode('latin-1') + body)
+        await writer.drain()
+        writer.close()
+
+    async def serve(self, host, port):
+        server = await asyncio.start_server(self.handle, host, port)
+        print("Serving on http://" + host + ":" + str(port) + "/")
+        async with server:
+            await server.serve_forever()
+
+def main(read, port):
+    index = QueryIndex(fd.read_fixed_data(read + ".csv"), read + ".json")
+    asyncio.run(QueryService(index).serve(default_host, port))
+
+def usage():
+    print("Usage: ./queryService.py <file prefix> [port]")
+
+if __name__ == "__main__":
+    if (len(sys.argv) not in (2, 3)):
+        usage()
+    elif (len(sys.argv) == 3 and not sys.argv[2].isdigit()):
+        print("Port should be a number: " + sys.argv[2])
+        usage()
+    elif (not os.path.exists(data_path + sys.argv[1] + ".csv")):
+        print("File does not exist: " + data_path + sys.argv[1] + ".csv")
+        usage()
+    elif (not os.path.exists(data_path + sys.argv[1] + ".json")):
+        print("File does not exist: " + data_path + sys.argv[1] + ".json")
+        usage()
+    else:
+        main(data_path + sys.argv[1], int(sys.argv[2]) if len(sys.argv) == 3 else default_port)
@@ -0,0 +1,281 @@
+#!/usr/bin/env python
+
+import pandas as pd
+import numpy as np
+import sys
+import os.path
+import json
+import math
+import itertools
+from multiprocessing import Pool
+
+import generateGraphs as gg
+
+data_path = "../data/"
+chunk_size = 10000 # number of records read at a time
+top_size = 25 # number of heavy hitters reported
+
+# Sketches learnt from:
+# Cormode and Muthukrishnan, An Improved Data Stream Summary: The Count-Min Sketch and its Applications
+# Misra and Gries, Finding Repeated Elements
+# Agarwal et al., Mergeable Summaries
+# Flajolet et al., HyperLogLog: the analysis of a near-optimal cardinality estimation algorithm
+# Every sketch below can be merged with another of the same size, so that files or chunks can be
+# summarised separately (e.g. on different cores) and combined afterwards.
+
+def hashItems(items):
+    """Given a list of strings items, return their 64 bit hashes as a numpy array; unlike hash(),
+    these are the same in every process so that sketches from different processes can be merged"""
+    return pd.util.hash_array(np.asarray(items, dtype=object))
+
+def bitLength(values):
+    """Given a numpy array of 64 bit unsigned integers, return the number of bits needed for each"""
+    values = values.copy()
+    length = np.zeros(len(values), dtype=np.int64)
+    for shift in (32, 16, 8, 4, 2, 1):
+        big = values >= (np.uint64(1) << np.uint64(shift))
+        values[big] >>= np.uint64(shift)
+        length[big] += shift
+    return length + (values > 0)
+
+class CountMinSketch:
+    """approximate counter of items never underestimating; with probability 1 - delta, an estimate
+    exceeds the true count by at most epsilon times the total number of items counted"""
+
+    def __init__(self, width=2048, depth=5):
+        self.width = width
+        self.depth = depth
+        self.table = np.zeros((depth, width), dtype=np.int64)
+        self.total = 0
+
+    def columns(self, items):
+        """returns the column of each item in each row of the table, from two halves of its hash"""
+        hashes = hashItems(items)
+        low = hashes & np.uint64(0xffffffff)
+        high = (hashes >> np.uint64(32)) | np.uint64(1)
+        rows = np.arange(self.depth, dtype=np.uint64).reshape(-1, 1)
+        return ((low + rows * high) % np.uint64(self.width)).astype(np.int64)
+
+    def update(self, items):
+        """counts each occurrence of the strings in items"""
+        if len(items) == 0:
+            return
+        columns = self.columns(items)
+        for row in range(self.depth):
+            self.table[row] += np.bincount(columns[row], minlength=self.width)
+        self.total += len(items)
+
+    def estimate(self, items):
+        """returns the estimated count of each of the strings in items"""
+        if len(items) == 0:
+            return np.zeros(0, dtype=np.int64)
+        columns = self.columns(items)
+        return self.table[np.arange(self.depth).reshape(-1, 1), columns].min(axis=0)
+
+    def merge(self, other):
+        """adds the counts of other, a sketch of the same size, to this sketch"""
+        if (self.width, self.depth) != (other.width, other.depth):
+            raise ValueError("Cannot merge Count-Min sketches of different sizes")
+        self.table += other.table
+        self.total += other.total
+
+    def epsilon(self):
+        return math.e / self.width
+
+    def delta(self):
+        return math.exp(-self.depth)
+
+class HeavyHitters:
+    """Misra-Gries summary keeping at most capacity counters; a counter is never above the true
+    count of its item and at most error below it, where error is at most total / (capacity + 1)"""
+
+    def __init__(self, capacity=100):
+        self.capacity = capacity
+        self.counters = {}
+        self.total = 0
+        self.error = 0
+
+    def update(self, items):
+        """counts each occurrence of the strings in items"""
+        counts = pd.Series(items, dtype=object).value_counts()
+        self.add(dict(zip(counts.index, counts.values.tolist())), len(items), 0)
+
+    def merge(self, other):
+        """adds the counters of other to this summary"""
+        self.add(other.counters, other.total, other.error)
+
+    def add(self, counters, total, error):
+        """adds counters with the given total and error to this summary, then subtracts the
+        (capacity + 1)-th largest counter from all counters so that at most capacity remain"""
+        for item, count in counters.items():
+            self.counters[item] = self.counters.get(item, 0) + count
+        self.total += total
+        self.error += error
+
+        if len(self.counters) > self.capacity:
+            cut = sorted(self.counters.values(), reverse=True)[self.capacity]
+            self.counters = {item: count - cut for item, count in self.counters.items() if count > cut}
+            self.error += cut
+
+    def top(self, n):
+        """returns the n items with the largest counters and their counters"""
+        return sorted(self.counters.items(), key=lambda x: x[1], reverse=True)[:n]
+
+class HyperLogLog:
+    """approximate counter of distinct items, with a relative standard error of 1.04 / sqrt(2^precision)"""
+
+    def __init__(self, precision=14):
+        self.precision = precision
+        self.registers = np.zeros(2 ** precision, dtype=np.uint8)
+
+    def update(self, items):
+        """adds the strings in items to the set counted"""
+        if len(items) == 0:
+            return
+        hashes = hashItems(items)
+        p = np.uint64(self.precision)
+        register = (hashes >> (np.uint64(64) - p)).astype(np.int64) # first bits choose the register
+        rest = hashes << p # remaining bits, rank is the position of their first 1
+        rank = np.minimum(64 - bitLength(rest) + 1, 64 - self.precision + 1)
+        np.maximum.at(self.registers, register, rank.astype(np.uint8))
+
+    def merge(self, other):
+        """adds the set counted by other, a sketch of the same precision, to this sketch"""
+        if self.precision != other.precision:
+            raise ValueError("Cannot merge HyperLogLog sketches of different precisions")
+        np.maximum(self.registers, other.registers, out=self.registers)
+
+    def estimate(self):
+        """returns the estimated number of distinct items"""
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / np.sum(np.power(2.0, -self.registers.astype(np.float64)))
+        zeros = np.count_nonzero(self.registers == 0)
+        if estimate <= 2.5 * m and zeros > 0:
+            estimate = m * math.log(m / zeros) # linear counting is more accurate for small sets
+        return int(round(estimate))
+
+    def relativeError(self):
+        return 1.04 / math.sqrt(len(self.registers))
+
+def hashtagsOf(chunk):
+    """Given a dataframe chunk, return the hashtags used in it"""
+    return [h for x in chunk['entities_str'].dropna() for h in gg.getHashtagsOfTweet(x)]
+
+def applicationsOf(chunk):
+    """Given a dataframe chunk, return the application each tweet in it was sent from, using the
+    same rules as fixdata.create_application_columns and fixdata.refine_application for data that
+    has not been through fixdata.py"""
+    if 'applications' in chunk.columns:
+        apps = chunk['applications']
+    else:
+        apps = chunk['source'].str.extract(r"<.*>(.*)</.*>", expand=False)
+        apps = apps.where(~apps.str.contains("Twitter", na=False), apps.str[0:7])
+    return apps.dropna().tolist()
+
+class StreamSummary:
+    """approximate counts of hashtags, applications, users and hashtags for records read in one pass"""
+
+    def __init__(self):
+        self.records = 0
+        self.hashtag_counts = CountMinSketch()
+        self.hashtag_top = HeavyHitters()
+        self.application_counts = CountMinSketch()
+        self.application_top = HeavyHitters()
+        self.users = HyperLogLog()
+        self.hashtags = HyperLogLog()
+
+    def update(self, chunk):
+        """adds the records of dataframe chunk to the summary"""
+        hashtags = hashtagsOf(chunk)
+        applications = applicationsOf(chunk)
+
+        self.records += len(chunk)
+        self.hashtag_counts.update(hashtags)
+        self.hashtag_top.update(hashtags)
+        self.application_counts.update(applications)
+        self.application_top.update(applications)
+        self.users.update(chunk['from_user_id_str'].dropna().tolist())
+        self.hashtags.update(hashtags)
+
+    def merge(self, other):
+        """adds the records summarised by other to the summary"""
+        self.records += other.records
+        self.hashtag_counts.merge(other.hashtag_counts)
+        self.hashtag_top.merge(other.hashtag_top)
+        self.application_counts.merge(other.application_counts)
+        self.application_top.merge(other.application_top)
+        self.users.merge(other.users)
+        self.hashtags.merge(other.hashtags)
+
+    def report(self, n=top_size):
+        """returns a dictionary of the estimates with their error bounds"""
+
+        def top(counts, heavy):
+            # the Misra-Gries counter is a lower bound, the Count-Min estimate an upper bound
+            items = heavy.top(n)
+            upper = counts.estimate([item for item, _ in items])
+            return [{'item': item, 'lower': int(count), 'upper': int(min(u, count + heavy.error))}
+                    for (item, count), u in zip(items, upper)]
+
+        def bounds(counts, heavy):
+            return {'total': int(counts.total),
+                    'max_undercount': int(heavy.error),
+                    'max_overcount': math.ceil(counts.epsilon() * counts.total),
+                    'confidence': 1 - counts.delta()}
+
+        return {'records': self.records,
+                'top_hashtags': top(self.hashtag_counts, self.hashtag_top),
+                'hashtag_bounds': bounds(self.hashtag_counts, self.hashtag_top),
+                'top_applications': top(self.application_counts, self.application_top),
+                'application_bounds': bounds(self.application_counts, self.application_top),
+                'distinct_users': self.users.estimate(),
+                'distinct_hashtags': self.hashtags.estimate(),
+                'distinct_relative_error': self.users.relativeError()}
+
+def summarizeChunk(chunk):
+    """Given a dataframe chunk, return its StreamSummary"""
+    summary = StreamSummary()
+    summary.update(chunk)
+    return summary
+
+def summarizeFiles(files, processes=None):
+    """Given a list of CSV filepaths, return the StreamSummary of all their records, read in chunks
+    of chunk_size records summarised in parallel by processes worker processes (one per core if
+    None), with at most one chunk per worker in memory at a time"""
+    summary = StreamSummary()
+    workers = processes if processes is not None else os.cpu_count() or 1
+    with Pool(workers) as pool:
+        for file in files:
+            columns = pd.read_csv(file, nrows=0).columns
+            usecols = [c for c in ['entities_str', 'from_user_id_str', 'source', 'applications']
+                       if c in columns]
+            chunks = pd.read_csv(file, usecols=usecols, dtype=str, chunksize=chunk_size)
+            # the pool would otherwise read the whole file ahead of the workers, so chunks are
+            # handed out one batch of about one per worker at a time
+            while True:
+                batch = list(itertools.islice(chunks, workers))
+                if not batch:
+                    break
+                for part in pool.imap_unordered(summarizeChunk, batch):
+                    summary.merge(part)
+    return summary
+
+def main(files):
+    print(json.dumps(summarizeFiles(files).report(), indent=2))
+
+def usage():
+    print("Usage: ./sketches.py <csv filename> [<csv filename> ...]")
+
+if __name__ == "__main__":
+    if (len(sys.argv) < 2):
+        usage()
+    elif (not all(f.endswith(".csv") for f in sys.argv[1:])):
+        print("Files should be CSV files: " + " ".join(sys.argv[1:]))
+        usage()
+    elif (not all(os.path.exists(data_path + f) for f in sys.argv[1:])):
+        print("File does not exist: " + " ".join(
+            data_path + f for f in sys.argv[1:] if not os.path.exists(data_path + f)))
+        usage()
+    else:
+        main([data_path + f for f in sys.argv[1:]])
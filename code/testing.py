@@ -3,12 +3,23 @@
 import pandas as pd
 import numpy as np
 import sys
+import os
 import unittest
 import time
 import datetime
+import asyncio
+import json
+import tempfile
+
+import matplotlib
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
 
 import generateGraphs as gg
 import fixdata as fd
+import queryService as qs
+import sketches as sk
+import threads as th
 
 pd.options.mode.chained_assignment = None  # default='warn'
 
@@ -21,6 +32,40 @@ def readCSV():
             )
     return df
 
+def createTestFrame():
+    """returns a small hand-built dataframe in the format of the fixed data, sorted by creation date"""
+    mention = '{"screen_name":"%s","name":"%s","id_str":"%s"}'
+    df = pd.DataFrame({
+        'id_str': ["10", "11", "12", "13"],
+        'from_user': ["ann", "bob", "cat", "ann"],
+        'from_user_id_str': ["1", "2", "3", "1"],
+        'text': ["#Philae #ESA", "RT @ann: #Philae #ESA", "@ann #Rosetta", "#Philae"],
+        'created_at': ["2014-11-12 10:00:00+00:00", "2014-11-12 10:20:00+00:00",
+                       "2014-11-12 11:05:00+00:00", "2014-11-13 09:00:00+00:00"],
+        'entities_str': [
+            '{"hashtags":[{"text":"CometLanding"},{"text":"Philae"},{"text":"ESA"}],"user_mentions":[]}',
+            '{"hashtags":[{"text":"Philae"},{"text":"ESA"}],"user_mentions":[' + mention % ("ann", "Ann", "1") + ']}',
+            '{"hashtags":[{"text":"Rosetta"}],"user_mentions":[' + mention % ("ann", "Ann", "1") + ']}',
+            '{"hashtags":[{"text":"Philae"}],"user_mentions":[]}'],
+        'in_reply_to_user_id_str': [np.nan, np.nan, "1", np.nan],
+        'in_reply_to_screen_name': [np.nan, np.nan, "ann", np.nan],
+        'in_reply_to_status_id_str': [np.nan, np.nan, "10", np.nan],
+        'retweet_user_id_str': [np.nan, "1", np.nan, np.nan],
+        'retweet_user_screen_name': [np.nan, "ann", np.nan, np.nan],
+        'applications': ["Twitter", "TweetDeck", "Twitter", "Twitter"],
+        'user_followers_count': pd.array([10, 20, 30, 11], dtype="Int64"),
+        'user_friends_count': pd.array([1, 2, 3, 4], dtype="Int64")})
+    fd.sort_by_created_at(df)
+    return df
+
+def route(service, path, **params):
+    """returns the status, content type and body answering a request for path with params"""
+    try:
+        content_type, body = asyncio.run(service.route(path, {k: [v] for k, v in params.items()}))
+    except qs.QueryError as e:
+        return e.status, None, None
+    return 200, content_type, json.loads(body) if content_type == "application/json" else body
+
 class Tests(unittest.TestCase):
     # Test on if filtering of dates is functioning properly.
     def test_one(self):
@@ -181,6 +226,343 @@ class Tests(unittest.TestCase):
         self.assertEqual(beforeRemoval - 1, afterRemoval)
     pass
 
+    # Tests that the chart cache of the query service discards the least recently used image.
+    def test_eleven(self):
+        cache = qs.LRUCache(2)
+        cache.put("tweet_type", b"1")
+        cache.put("top_applications", b"2")
+        self.assertEqual(cache.get("tweet_type"), b"1") # top_applications is now least recently used
+        cache.put("timeline_daily", b"3")
+
+        self.assertEqual(cache.get("top_applications"), None)
+        self.assertEqual(cache.get("tweet_type"), b"1")
+        self.assertEqual(cache.get("timeline_daily"), b"3")
+    pass
+
+    # Tests that time windows found by binary search match filtering every record.
+    def test_twelve(self):
+        df = readCSV().sample(frac=1, random_state=0) # shuffled
+        fd.sort_by_created_at(df)
+        self.assertEqual(df['created_at'].is_monotonic_increasing, True)
+
+        start = pd.Timestamp('2014-11-12 15:30', tz='UTC')
+        end = pd.Timestamp('2014-11-14', tz='UTC')
+        window = fd.time_window(df, start, end)
+        expected = df[(df['created_at'] >= start) & (df['created_at'] < end)]
+        self.assertEqual(window['id_str'].tolist(), expected['id_str'].tolist())
+
+        hours = fd.count_per_interval(df, start, end, pd.Timedelta(hours=1))
+        self.assertEqual(len(hours), 33)
+        self.assertEqual(hours.sum(), len(expected))
+        self.assertEqual(hours.iloc[0], len(fd.time_window(df, start, '2014-11-12 16:30')))
+    pass
+
+    # Tests that filtering parses dates in the format of the original dataset when not yet parsed.
+    def test_twenty(self):
+        df = pd.DataFrame({
+            'id_str': ["1", "2", "3", "4"],
+            'from_user_id_str': ["1", "2", "3", "4"],
+            'text': ["#CometLanding"] * 4,
+            'entities_str': ['{"hashtags":[{"text":"CometLanding"}]}'] * 4,
+            'created_at': ["Tue Dec 09 11:10:14 +0000 2014", "Wed Nov 12 09:09:13 +0000 2014",
+                           "Tue Nov 11 23:59:59 +0000 2014", "Thu Nov 13 10:00:00 +0000 2014"]})
+        fd.filter_data(df)
+        self.assertEqual(df['id_str'].tolist(), ["2", "4"])
+        self.assertEqual(df['created_at'].iloc[0], pd.Timestamp('2014-11-12 09:09:13', tz='UTC'))
+
+        fixed = pd.DataFrame(df[['id_str', 'from_user_id_str', 'text', 'entities_str']])
+        fixed['created_at'] = ["2014-11-13 10:00:00+00:00", "2014-11-12 09:09:13+00:00"]
+        fd.filter_data(fixed, fd.fixed_created_at_format)
+        self.assertEqual(fixed['id_str'].tolist(), ["4", "2"]) # sorted again by the new dates
+    pass
+
+    # Tests that the 2014-11-12 timeline is drawn empty when there is no tweet that day.
+    def test_twenty_one(self):
+        df = createTestFrame()
+        later = fd.time_window(df, "2014-11-13")
+        self.assertEqual(len(later), 1)
+
+        plt.close('all')
+        gg.createActiveDayTimelinePlot(later)
+        self.assertEqual(len(plt.gca().containers), 0) # nothing drawn
+        plt.close('all')
+
+        gg.createActiveDayTimelinePlot(df)
+        self.assertEqual(len(plt.gca().containers), 1) # one stem plot, with the tweets per hour
+        self.assertEqual([int(y) for y in plt.gca().containers[0].markerline.get_ydata()], [2, 1])
+        plt.close('all')
+        plt.rcdefaults()
+    pass
+
+    # Tests that hashtag co-occurrence from the sparse incidence matrix matches counting pairs by hand.
+    def test_thirteen(self):
+        df = pd.DataFrame({'entities_str': [
+            '{"hashtags":[{"text":"CometLanding"},{"text":"Philae"},{"text":"ESA"}]}',
+            '{"hashtags":[{"text":"Philae"},{"text":"ESA"},{"text":"Philae"}]}',
+            '{"hashtags":[{"text":"Philae"},{"text":"Rosetta"}]}',
+            '{"hashtags":[{"text":"cometlanding"}]}']})
+        incidence, hashtags = gg.createHashtagIncidenceMatrix(df)
+        self.assertEqual(incidence.shape, (4, 3))
+        self.assertEqual(incidence.sum(), 6) # repeated Philae in second tweet counted once
+
+        pairs = gg.getHashtagCooccurrence(incidence, hashtags)
+        self.assertEqual(len(pairs), 2)
+        top = pairs.iloc[0]
+        self.assertEqual({top['source'], top['target']}, {"Philae", "ESA"})
+        self.assertEqual(top['weight'], 2)
+        self.assertAlmostEqual(top['lift'], 2 * 4 / (3 * 2))
+        self.assertAlmostEqual(top['pmi'], np.log2(2 * 4 / (3 * 2)))
+
+        network = gg.createHashtagNetwork(pairs)
+        self.assertEqual(network["Philae"]["Rosetta"]['weight'], 1)
+        self.assertEqual(len(gg.getHashtagCooccurrence(incidence, hashtags, min_count=2)), 1)
+    pass
+
+    # Tests that merged sketches stay within their error bounds of the exact counts.
+    def test_fourteen(self):
+        items = ["Philae"] * 500 + ["ESA"] * 300 + ["tag" + str(i) for i in range(5000)]
+        exact = pd.Series(items).value_counts()
+
+        counts, heavy, distinct = sk.CountMinSketch(), sk.HeavyHitters(10), sk.HyperLogLog()
+        for part in (items[::2], items[1::2]): # summarised separately then merged
+            c, h, d = sk.CountMinSketch(), sk.HeavyHitters(10), sk.HyperLogLog()
+            c.update(part)
+            h.update(part)
+            d.update(part)
+            counts.merge(c)
+            heavy.merge(h)
+            distinct.merge(d)
+
+        estimates = counts.estimate(exact.index.tolist())
+        self.assertEqual(all(estimates >= exact.values), True) # never underestimates
+        self.assertEqual(heavy.error <= len(items) / 11, True)
+        self.assertEqual([item for item, _ in heavy.top(2)], ["Philae", "ESA"])
+        for item, count in heavy.top(2):
+            self.assertEqual(exact[item] - heavy.error <= count <= exact[item], True)
+        self.assertEqual(abs(distinct.estimate() - len(exact)) <= 4 * distinct.relativeError() * len(exact),
+                         True)
+    pass
+
+    # Tests that replies are linked to their threads with the right depth and metrics.
+    def test_fifteen(self):
+        df = pd.DataFrame({
+            'id_str': ["1", "2", "3", "4", "5", "6"],
+            'in_reply_to_status_id_str': [np.nan, "1", "2", "1", "9", "5"], # 9 is not in the data
+            'from_user': ["a", "b", "c", "d", "e", "f"],
+            'text': ["t"] * 6,
+            'created_at': ["2014-11-12 10:00:00+00:00", "2014-11-12 10:05:00+00:00",
+                           "2014-11-12 10:06:00+00:00", "2014-11-12 10:07:00+00:00",
+                           "2014-11-12 11:00:00+00:00", "2014-11-12 11:30:00+00:00"]})
+        fd.sort_by_created_at(df)
+        threads = th.buildThreadIndex(df)
+        self.assertEqual(threads['parent'].tolist(), [-1, 0, 1, 0, -1, 4])
+        self.assertEqual(threads['root'].tolist(), [0, 0, 0, 0, 4, 4])
+        self.assertEqual(threads['depth'].tolist(), [0, 1, 2, 1, 0, 1])
+
+        metrics = th.getThreadMetrics(df, threads)
+        self.assertEqual(metrics['id_str'].tolist(), ["1", "5"])
+        self.assertEqual(metrics['size'].tolist(), [4, 2])
+        self.assertEqual(metrics['depth'].tolist(), [2, 1])
+        self.assertEqual(metrics['first_reply_seconds'].tolist(), [300, 1800])
+        self.assertEqual(metrics['partial'].tolist(), [False, True])
+
+        self.assertEqual(th.getMostRepliedTweets(df, threads, 1)['id_str'].tolist(), ["1"])
+    pass
+
+    # Tests that the user rollup counts tweets sent and retweets, replies and mentions received.
+    def test_sixteen(self):
+        mention = '{"screen_name":"%s","name":"%s","id_str":"%s"}'
+        df = pd.DataFrame({
+            'from_user_id_str': ["1", "2", "1"],
+            'from_user': ["ann", "bob", "ann_new"],
+            'text': ["hi @bob", "RT @ann: hi @bob", "@bob hello"],
+            'entities_str': ['{"user_mentions":[' + mention % ("bob", "Bob", "2") + ']}',
+                             '{"user_mentions":[' + mention % ("ann", "Ann", "1") + ','
+                                                  + mention % ("bob", "Bob", "2") + ']}',
+                             '{"user_mentions":[' + mention % ("bob", "Bob", "2") + ']}'],
+            'retweet_user_id_str': [np.nan, "1", np.nan],
+            'retweet_user_screen_name': [np.nan, "ann", np.nan],
+            'in_reply_to_user_id_str': [np.nan, np.nan, "2"],
+            'in_reply_to_screen_name': [np.nan, np.nan, "bob"],
+            'applications': ["Twitter", "TweetDeck", "TweetDeck"],
+            'user_followers_count': pd.array([10, 20, 11], dtype="Int64"),
+            'user_friends_count': pd.array([5, 6, 7], dtype="Int64"),
+            'created_at': ["2014-11-12 10:00:00+00:00", "2014-11-12 10:05:00+00:00",
+                           "2014-11-12 10:10:00+00:00"]})
+        fd.sort_by_created_at(df)
+        fd.create_mention_columns(df)
+        # retweeted ann and replied bob left out
+        self.assertEqual(df['mention_user_ids_str'].tolist(), ["2", "2", ""])
+
+        rollup = fd.create_user_rollup(df)
+        self.assertEqual(rollup.index.tolist(), [1, 2])
+        self.assertEqual(rollup.loc[1, 'screen_name'], "ann_new")
+        self.assertEqual(rollup['tweets'].tolist(), [2, 1])
+        self.assertEqual(rollup['retweets_received'].tolist(), [1, 0])
+        self.assertEqual(rollup['replies_received'].tolist(), [0, 1])
+        self.assertEqual(rollup['mentions_received'].tolist(), [0, 2])
+        self.assertEqual(rollup['applications_used'].tolist(), [2, 1])
+        self.assertEqual(rollup['user_followers_count'].tolist(), [11, 20])
+        self.assertEqual(rollup['user_friends_count'].tolist(), [7, 6])
+    pass
+
+    # Tests the timeline of the query service, windowed and aligned on the start given.
+    def test_eighteen(self):
+        service = qs.QueryService(qs.QueryIndex(createTestFrame(), None))
+
+        status, _, body = route(service, "/timeline", granularity="hour")
+        self.assertEqual(status, 200)
+        self.assertEqual([b['start'] for b in body][:2],
+                         ["2014-11-12T10:00:00+00:00", "2014-11-12T11:00:00+00:00"])
+        self.assertEqual([b['count'] for b in body][:2], [2, 1])
+        self.assertEqual(sum(b['count'] for b in body), 4)
+
+        status, _, body = route(service, "/timeline", granularity="hour",
+                                start="2014-11-12T09:30", end="2014-11-13")
+        self.assertEqual([(b['start'], b['count']) for b in body],
+                         [("2014-11-12T09:30:00+00:00", 2), ("2014-11-12T10:30:00+00:00", 1)])
+
+        # a far start is clamped to the tweets in the window, keeping the alignment on start
+        status, _, body = route(service, "/timeline", granularity="minute", start="1970-01-01")
+        self.assertEqual(body[0]['start'], "2014-11-12T10:00:00+00:00")
+        self.assertEqual(body[-1]['start'], "2014-11-13T09:00:00+00:00")
+
+        self.assertEqual(route(service, "/timeline", start="2015-01-01")[2], [])
+        self.assertEqual(route(service, "/timeline", granularity="year")[0], 400)
+        self.assertEqual(route(service, "/timeline", start="never")[0], 400)
+    pass
+
+    # Tests the other queries of the query service and their errors.
+    def test_nineteen(self):
+        index = qs.QueryIndex(createTestFrame(), None)
+        service = qs.QueryService(index)
+
+        status, _, body = route(service, "/users", id="1")
+        self.assertEqual(status, 200)
+        self.assertEqual((body['screen_name'], body['tweets'], body['retweets_received'],
+                          body['replies_received']), ("ann", 2, 1, 1))
+        self.assertEqual(route(service, "/users", id="99")[0], 404)
+        self.assertEqual(route(service, "/users")[0], 400)
+        self.assertEqual(route(service, "/users", id="ann")[0], 400)
+
+        self.assertEqual(route(service, "/hashtags", top="1")[2], [{'hashtag': "Philae", 'count': 3}])
+        self.assertEqual(sorted((h['hashtag'], h['count']) for h in
+                                route(service, "/hashtags", start="2014-11-12T11:00")[2]),
+                         [("Philae", 1), ("Rosetta", 1)])
+        status, _, body = route(service, "/hashtag_pairs", by="lift")
+        self.assertEqual((body[0]['source'], body[0]['target'], body[0]['weight']), ("Philae", "ESA", 2))
+        self.assertEqual(route(service, "/hashtag_pairs", by="size")[0], 400)
+
+        self.assertEqual(route(service, "/neighbours", user="cat")[2]['replied_to'], {"ann": 1})
+        self.assertEqual(route(service, "/neighbours", user="dan")[0], 404)
+        self.assertEqual(route(service, "/threads")[2][0]['id_str'], "10")
+        self.assertEqual(route(service, "/nowhere")[0], 404)
+
+        # popular_hashtags covers the full dataset, so any window is answered from one cached image
+        index.chart_cache.put(("popular_hashtags", None, None), b"cached")
+        self.assertEqual(route(service, "/charts/popular_hashtags.png", start="2014-11-13")[2], b"cached")
+        self.assertEqual(len(index.chart_cache.entries), 1)
+
+        status, content_type, image = route(service, "/charts/tweet_type.png", end="2014-11-13")
+        self.assertEqual((status, content_type, image[:4]), (200, "image/png", b"\x89PNG"))
+        self.assertEqual(route(service, "/charts/unknown.png")[0], 404)
+        self.assertEqual(route(service, "/charts/tweet_type.png", start="2015-01-01")[0], 404)
+    pass
+
+    # Tests that the user rollup can be built from the fixed CSV read back with read_fixed_data.
+    def test_seventeen(self):
+        df = fd.read_fixed_data("../data/CometLandingFixed.csv")
+        self.assertEqual(pd.api.types.is_float_dtype(df['mention_user_ids_str']), False)
+        rollup = fd.create_user_rollup(df)
+        self.assertEqual(rollup['tweets'].sum(), len(df))
+        self.assertEqual(rollup.index.dtype, np.int64)
+
+        # a column without any tweet mentioning two users is read back as strings, not floats
+        single = df.head(50)
+        single['mention_user_ids_str'] = single['mention_user_ids_str'].str.split().str[0]
+        file = "../data/CometLandingFixedTest.csv"
+        single.to_csv(file, index=False)
+        try:
+            reread = fd.read_fixed_data(file)
+        finally:
+            os.remove(file)
+        self.assertEqual(reread['mention_user_ids_str'].dropna().tolist(),
+                         single['mention_user_ids_str'].dropna().tolist())
+        self.assertEqual(fd.create_user_rollup(reread)['mentions_received'].sum(),
+                         single['mention_user_ids_str'].notna().sum())
+    pass
+
+    # Tests that the hashtag index of the query service, built from the incidence matrix, and the
+    # sketches find the same hashtags as parsing every tweet.
+    def test_twenty_two(self):
+        df = createTestFrame()
+        self.assertEqual(gg.getHashtagsOfTweet(df['entities_str'][0]), ["Philae", "ESA"])
+
+        incidence, hashtags = gg.createHashtagIncidenceMatrix(df)
+        index = qs.createHashtagIndex(df, incidence, hashtags)
+        parsed = [(t, h) for t, x in zip(df['created_at'], df['entities_str'])
+                  for h in gg.getHashtagsOfTweet(x)]
+        self.assertEqual(sorted(zip(index['created_at'], index['hashtag'])), sorted(parsed))
+        self.assertTrue(index['created_at_epoch'].is_monotonic_increasing)
+        self.assertEqual(sorted(sk.hashtagsOf(df)), sorted(h for _, h in parsed))
+    pass
+
+    # Tests that /neighbours counts mentions the same way as the user rollup behind /users.
+    def test_twenty_three(self):
+        df = createTestFrame()
+        service = qs.QueryService(qs.QueryIndex(df, None))
+
+        # bob's retweet and cat's reply name ann only as the retweeted and replied user
+        for user in ["bob", "cat"]:
+            self.assertNotIn('mentioned', route(service, "/neighbours", user=user)[2])
+        self.assertEqual(route(service, "/users", id="1")[2]['mentions_received'], 0)
+
+        # a mention of a user who never tweeted is named from the entities of the tweet
+        df = createTestFrame()
+        df.loc[0, 'entities_str'] = '{"hashtags":[],"user_mentions":[{"screen_name":"esa","id_str":"9"}]}'
+        df.loc[3, 'entities_str'] = '{"hashtags":[],"user_mentions":[{"screen_name":"bob","id_str":"2"}]}'
+        service = qs.QueryService(qs.QueryIndex(df, None))
+        self.assertEqual(route(service, "/neighbours", user="ann")[2]['mentioned'], {"esa": 1, "bob": 1})
+        for id, user in [("9", "esa"), ("2", "bob")]:
+            self.assertEqual(route(service, "/users", id=id)[2]['mentions_received'],
+                             sum(route(service, "/neighbours", user=user)[2]['mentioned_by'].values()))
+    pass
+
+    # Tests that summarizeFiles, reading an original format file in several chunks, reports bounds
+    # containing the exact counts and maps applications the same way as fixdata.py.
+    def test_twenty_four(self):
+        source = '<a href="http://twitter.com" rel="nofollow">%s</a>'
+        apps = ["Twitter for iPhone", "Twitter Web Client", "TweetDeck", "Twitter for Android"] * 5
+        tags = ["Philae", "ESA", "Philae", "Rosetta", "CometLanding"] * 4
+        df = pd.DataFrame({
+            'from_user_id_str': [str(i % 7) for i in range(20)],
+            'entities_str': ['{"hashtags":[{"text":"%s"}],"user_mentions":[]}' % t for t in tags],
+            'source': [source % a for a in apps]})
+
+        size = sk.chunk_size
+        sk.chunk_size = 6 # several chunks, so several summaries are merged
+        try:
+            with tempfile.TemporaryDirectory() as directory:
+                file = os.path.join(directory, "CometLandingTest.csv")
+                df.to_csv(file, index=False)
+                report = sk.summarizeFiles([file], processes=1).report()
+        finally:
+            sk.chunk_size = size
+
+        fixed = df.copy()
+        fd.create_application_columns(fixed)
+        fd.refine_application(fixed)
+        for top, exact in [(report['top_hashtags'], pd.Series(tags)[pd.Series(tags) != "CometLanding"]),
+                           (report['top_applications'], fixed['applications'])]:
+            counts = exact.value_counts()
+            self.assertEqual(sorted(t['item'] for t in top), sorted(counts.index))
+            for t in top:
+                self.assertEqual(t['lower'] <= counts[t['item']] <= t['upper'], True)
+        self.assertEqual(report['top_applications'][0]['item'], "Twitter")
+        self.assertEqual(report['records'], 20)
+        self.assertEqual(report['distinct_users'], 7)
+    pass
+
 def suite():
     loader = unittest.TestLoader()
     testsuite = loader.loadTestsFromTestCase(Tests)
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+
+import pandas as pd
+import numpy as np
+import sys
+import os.path
+
+import fixdata as fd
+
+data_path = "../data/"
+
+# Threads are stored as arrays of positions in the dataframe (-1 for none) rather than python
+# objects, and walked with pointer jumping: every tweet repeatedly replaces the ancestor it points
+# to with that ancestor's own ancestor, so all tweets reach the root of their thread after about
+# log2(depth) vectorized steps, without recursion or a python loop over the tweets.
+# pointer jumping learnt from:
+# Hillis and Steele, Data Parallel Algorithms, Communications of the ACM 29(12), 1986
+
+def buildThreadIndex(df):
+    """Given a dataframe df, return a dataframe with the same index holding, for each tweet, the
+    position in df of the tweet it replies to ('parent', -1 if it is not a reply to a tweet in df),
+    the position of the first tweet of its thread ('root') and its number of replies from the root
+    ('depth')"""
+
+    n = len(df)
+    position_type = np.int32 if n < 2 ** 31 else np.int64
+    positions = np.arange(n, dtype=position_type)
+
+    # hash index of tweet ids, keeping the first tweet for ids seen more than once
+    first = ~df['id_str'].duplicated().values
+    id_index = pd.Index(df['id_str'].values[first])
+
+    # link every reply to its parent in a single join, -1 where the parent is not in the data
+    found = id_index.get_indexer(df['in_reply_to_status_id_str'].values)
+    parent = np.where(found >= 0, np.flatnonzero(first)[np.maximum(found, 0)], -1).astype(position_type)
+    parent[parent == positions] = -1 # a tweet cannot reply to itself
+
+    # jump holds the furthest known ancestor of each tweet and depth the number of replies to it
+    jump = np.where(parent >= 0, parent, positions)
+    depth = (parent >= 0).astype(position_type)
+    for _ in range(int(n).bit_length() + 1):
+        next_jump = jump[jump]
+        if np.array_equal(next_jump, jump):
+            break
+        depth += depth[jump]
+        jump = next_jump
+
+    # malformed data may contain reply cycles, which never reach a tweet without a parent; such
+    # tweets are made roots of their own
+    cyclic = parent[jump] >= 0
+    parent[cyclic] = -1
+    jump[cyclic] = positions[cyclic]
+    depth[cyclic] = 0
+
+    return pd.DataFrame({'parent': parent, 'root': jump, 'depth': depth}, index=df.index)
+
+def getThreadMetrics(df, threads):
+    """Given a dataframe df sorted with fixdata.sort_by_created_at and its thread index threads,
+    return a dataframe with one row for each thread with at least one reply, with the root tweet,
+    the number of tweets in the thread, its depth, the number of direct replies to the root and
+    the seconds from the root to its first reply, sorted from the largest thread"""
+
+    n = len(df)
+    parent = threads['parent'].values
+    root = threads['root'].values
+    epoch = df['created_at_epoch'].values
+    replies = parent >= 0
+
+    size = np.bincount(root, minlength=n)
+    depth = np.zeros(n, dtype=threads['depth'].dtype)
+    np.maximum.at(depth, root, threads['depth'].values)
+    direct = np.bincount(parent[replies], minlength=n)
+    first_reply = np.full(n, np.iinfo(np.int64).max)
+    np.minimum.at(first_reply, parent[replies], epoch[replies])
+
+    roots = np.flatnonzero(size > 1)
+    metrics = pd.DataFrame({
+        'id_str': df['id_str'].values[roots],
+        'from_user': df['from_user'].values[roots],
+        'created_at': df['created_at'].iloc[roots].reset_index(drop=True),
+        'size': size[roots],
+        'depth': depth[roots],
+        'replies': direct[roots],
+        'first_reply_seconds': first_reply[roots] - epoch[roots],
+        # the root is itself a reply, to a tweet missing from the data
+        'partial': pd.notna(df['in_reply_to_status_id_str'].values[roots]),
+    })
+    return metrics.sort_values(['size', 'depth'], ascending=False, kind='mergesort').reset_index(drop=True)
+
+def getMostRepliedTweets(df, threads, top=25):
+    """Given a dataframe df and its thread index threads, return a dataframe of the top tweets
+    with the most direct replies"""
+    parent = threads['parent'].values
+    direct = np.bincount(parent[parent >= 0], minlength=len(df))
+    most = np.argsort(-direct, kind='stable')[:top]
+    most = most[direct[most] > 0]
+    return pd.DataFrame({'id_str': df['id_str'].values[most], 'from_user': df['from_user'].values[most],
+                         'text': df['text'].values[most], 'replies': direct[most]})
+
+def main(read):
+    df = fd.read_fixed_data(read + ".csv")
+    threads = buildThreadIndex(df)
+    getThreadMetrics(df, threads).to_csv(read + "Threads.csv", index=False)
+
+def usage():
+    print("Usage: ./threads.py <file prefix>")
+
+if __name__ == "__main__":
+    if (len(sys.argv) != 2):
+        usage()
+    elif (not os.path.exists(data_path + sys.argv[1] + ".csv")):
+        print("File does not exist: " + data_path + sys.argv[1] + ".csv")
+        usage()
+    else:
+        main(data_path + sys.argv[1])